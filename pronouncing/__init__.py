@@ -1,7 +1,11 @@
 from __future__ import print_function
-from itertools import chain
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain, compress, islice
+import numbers
 import re
 import collections
+import threading
 import cmudict
 
 __author__ = 'Allison Parrish'
@@ -12,6 +16,52 @@ pronunciations = None
 lookup = None
 rhyme_lookup = None
 
+# indexes for search() and search_stresses(), built by _init_search()
+_indexed = None
+_words = None
+_phones = None
+_phones_blob = None
+_phones_starts = None
+# more indexes, each only needed by some searches, so built the first time
+# one of those comes along (see _search_index())
+_search_indexes = {}
+# plain phone sequence searches to scan for before building the index of
+# phones, which takes about as long as this many scans save
+_postings_min = 10
+_postings_searches = 0
+
+_anchored_literal = re.compile(r"(\^?)([A-Z0-9]+(?: [A-Z0-9]+)*)(\$?)\Z")
+_prefix_literal = re.compile(r"\^([A-Z0-9 ]*)")
+_stress_literal = re.compile(r"\^([012]*)\$\Z")
+# \A, \Z, lookarounds and scoped flags (e.g. "(?-m:$)"), which can tell a
+# line in a joined blob of lines apart from the same line on its own
+_context_sensitive = re.compile(r"\\[AZ]|\(\?(?:<?[=!]|[a-zA-Z-]+:)")
+_search_lock = threading.Lock()
+_regex_cache = {}
+_regex_cache_size = 256
+# below this many phone sequences, search_many() just calls search() for each
+_search_many_min = 100
+_rhymes_indexed = None
+_rhymes_cache = {}
+_rhymes_cache_size = 4096
+
+
+class _StressTable(dict):
+    """A :meth:`str.translate` table that deletes everything but stresses.
+
+    Every ASCII character is listed up front so that the common case never
+    reaches :meth:`__missing__`, which handles any other character.
+    """
+    def __missing__(self, key):
+        return None
+
+
+_stress_table = _StressTable(
+    (i, i if chr(i) in '012' else None) for i in range(128))
+# the same, but keeping line breaks, for doing many lines in one go
+_stress_lines_table = _StressTable(_stress_table)
+_stress_lines_table[ord('\n')] = ord('\n')
+
 
 def parse_cmu(cmufh):
     """Parses an incoming file handle as a CMU pronouncing dictionary file.
@@ -19,6 +69,8 @@ def parse_cmu(cmufh):
     (Most end-users of this module won't need to call this function explicitly,
     as it's called internally by the :func:`init_cmu` function.)
 
+    Comments (from ``#`` to the end of a line) are left out of the phones.
+
     :param cmufh: a filehandle with CMUdict-formatted data
     :returns: a list of 2-tuples pairing a word with its phones (as a string)
     """
@@ -28,11 +80,13 @@ def parse_cmu(cmufh):
         if line.startswith(';'):
             continue
         word, phones = line.split(" ", 1)
+        if '#' in phones:
+            phones = phones.split('#', 1)[0].rstrip()
         pronunciations.append((word.split('(', 1)[0].lower(), phones))
     return pronunciations
 
 
-def init_cmu(filehandle=None):
+def init_cmu(filehandle=None, search_indexes=False):
     """Initialize the module's pronunciation data.
 
     This function is called automatically the first time you attempt to use
@@ -41,7 +95,13 @@ def init_cmu(filehandle=None):
     how the pronunciation data is loaded (e.g., you're using this module in
     a web application and want to load the data asynchronously).
 
+    The indexes used by :func:`search` and :func:`search_stresses` take
+    about as long again to build, so by default they're left until the
+    searches that need them. Pass ``search_indexes=True`` to build them all
+    now as well.
+
     :param filehandle: a filehandle with CMUdict-formatted data
+    :param search_indexes: if true, also build the indexes for searching
     :returns: None
     """
     global pronunciations, lookup, rhyme_lookup
@@ -50,14 +110,336 @@ def init_cmu(filehandle=None):
             filehandle = cmudict.dict_stream()
         pronunciations = parse_cmu(filehandle)
         filehandle.close()
-        lookup = collections.defaultdict(list)
-        for word, phones in pronunciations:
-            lookup[word].append(phones)
-        rhyme_lookup = collections.defaultdict(list)
+        # fill local names first: this loop runs once per entry, and looking
+        # up locals is quicker than looking up globals
+        by_word = collections.defaultdict(list)
+        by_rhyme = collections.defaultdict(list)
+        get_rhyming_part = rhyming_part
         for word, phones in pronunciations:
-            rp = rhyming_part(phones)
-            if rp is not None:
-                rhyme_lookup[rp].append(word)
+            by_word[word].append(phones)
+            by_rhyme[get_rhyming_part(phones)].append(word)
+        # plain dicts, so that looking up a missing key can't add it
+        lookup = dict(by_word)
+        rhyme_lookup = dict(by_rhyme)
+    if search_indexes:
+        _init_search()
+        for build in (_sort_lines, _sort_reversed_lines, _index_stresses,
+                      _index_phones):
+            _search_index(build)
+
+
+def _init_search():
+    """Build the indexes used by :func:`search` and :func:`search_stresses`.
+
+    This builds the ones that every search needs (more are built by
+    :func:`_search_index` when they're first needed). They're only built
+    the first time one of the search functions is called, unless
+    :func:`init_cmu` is asked to build them, and are rebuilt if the
+    pronunciation data has been replaced since.
+    """
+    global _words, _phones, _phones_blob, _phones_starts, _indexed
+    global _postings_searches
+    init_cmu()
+    if _indexed is pronunciations:
+        return
+    with _search_lock:
+        data = pronunciations
+        if _indexed is data:
+            # another thread built them while this one was waiting
+            return
+        # the words and phones as separate columns, plus the phones joined
+        # into one string
+        words = [word for word, phones in data]
+        phones_list = [phones for word, phones in data]
+        blob, starts = _join_lines(phones_list)
+        # everything is built before any of it is assigned, and _indexed is
+        # assigned last, so a search in another thread (which doesn't wait
+        # for the lock once _indexed is set) never sees half-built indexes
+        _search_indexes.clear()
+        _postings_searches = 0
+        _words, _phones = words, phones_list
+        _phones_blob, _phones_starts = blob, starts
+        _indexed = data
+
+
+def _search_index(build):
+    """Get one of the search indexes that are only built when first needed.
+
+    :param build: a function that builds the index from a list of phones
+        strings (which is also the index's key in ``_search_indexes``)
+    :returns: the index
+    """
+    try:
+        return _search_indexes[build]
+    except KeyError:
+        with _search_lock:
+            if build not in _search_indexes:
+                _search_indexes[build] = build(_phones)
+            return _search_indexes[build]
+
+
+def _index_stresses(lines):
+    """Index strings of phones by their stress patterns.
+
+    :param lines: a list of strings of phones
+    :returns: a dictionary mapping each stress pattern to an array of the
+        indices of the strings with that pattern
+    """
+    # stresses for every line at once, rather than calling stresses()
+    stress_list = "\n".join(lines).translate(_stress_lines_table).split('\n')
+    del stress_list[len(lines):]
+    index = collections.defaultdict(lambda: array('l'))
+    for i, stress in enumerate(stress_list):
+        index[stress].append(i)
+    return dict(index)
+
+
+def _join_lines(lines):
+    """Join strings with newlines for scanning with a single regex search.
+
+    Returns the joined string along with an array of the offset where each
+    line starts. The array has one extra item at the end (the offset of the
+    line that would come after the last), so that line ``i`` always spans
+    ``starts[i]`` up to ``starts[i + 1] - 1``.
+
+    :param lines: a list of strings
+    """
+    starts = array('l')
+    pos = 0
+    for line in lines:
+        starts.append(pos)
+        pos += len(line) + 1
+    starts.append(pos)
+    return "\n".join(lines), starts
+
+
+def _sort_lines(lines):
+    """Sort strings for prefix lookups with :func:`_search_sorted`.
+
+    A sorted list works like a (much smaller) trie: all of the strings that
+    start with a given prefix end up next to each other.
+
+    :param lines: a list of strings
+    :returns: a 2-tuple with the sorted strings and an array of each
+        string's index in the original list
+    """
+    order = array('l', sorted(range(len(lines)), key=lines.__getitem__))
+    return [lines[i] for i in order], order
+
+
+def _sort_reversed_lines(lines):
+    """Sort reversed strings for suffix lookups with :func:`_search_sorted`.
+
+    :param lines: a list of strings
+    :returns: a 2-tuple like the one returned from :func:`_sort_lines`, but
+        with each string reversed
+    """
+    return _sort_lines([line[::-1] for line in lines])
+
+
+def _with_prefix(index, prefix):
+    """Yield each string (and its index) in a sorted index with a prefix.
+
+    :param index: a 2-tuple returned from :func:`_sort_lines`
+    :param prefix: a string
+    """
+    keys, order = index
+    i = bisect_left(keys, prefix)
+    while i < len(keys) and keys[i].startswith(prefix):
+        yield keys[i], order[i]
+        i += 1
+
+
+def _search_sorted(index, prefix, whole=False):
+    """Get the indices of phone strings starting with the given phones.
+
+    The prefix only matches whole phones, so ``'S K'`` matches
+    ``'S K AY1'``, but ``'S K AY'`` doesn't.
+
+    :param index: a 2-tuple returned from :func:`_sort_lines`
+    :param prefix: a string of space-separated phones
+    :param whole: if true, only strings equal to the prefix match
+    :returns: a sorted list of indices
+    """
+    size = len(prefix)
+    return sorted(
+        i for key, i in _with_prefix(index, prefix)
+        if len(key) == size or (key[size] == ' ' and not whole))
+
+
+def _literal_prefix(pattern):
+    """Get the plain text that any match of an anchored pattern starts with.
+
+    For example, every match of ``'^S K \\w+1'`` starts with ``'S K '``.
+    Returns an empty string if the pattern isn't anchored to the start, or
+    if it might be anchored only in one branch of an alternation.
+    """
+    match = _prefix_literal.match(pattern)
+    if match is None or '|' in pattern:
+        return ''
+    prefix = match.group(1)
+    if pattern[match.end():match.end() + 1] in ('?', '*', '{'):
+        # the last character is optional or repeated
+        prefix = prefix[:-1]
+    return prefix
+
+
+def _search_prefixed(regexp, prefix):
+    """Get the indices of phone strings with a given prefix matching a regex.
+
+    Only the phone strings that start with the prefix (found with a bisect)
+    are checked against the regex, rather than the whole dictionary.
+
+    :param regexp: a compiled regular expression
+    :param prefix: a string that every match of the regex starts with
+    :returns: a sorted list of indices
+    """
+    prefixes = _search_index(_sort_lines)
+    candidates = sorted(i for key, i in _with_prefix(prefixes, prefix))
+    return [i for i in candidates if regexp.search(_phones[i])]
+
+
+def _search_stress_lookup(test):
+    """Get the indices of pronunciations whose stress pattern passes a test.
+
+    There are only a few hundred distinct stress patterns in CMUdict, so
+    checking each one and gathering up the pronunciations that share it is
+    much quicker than checking every pronunciation.
+
+    :param test: a function that takes a stress pattern and returns a true
+        value if it matches (e.g. the ``search`` method of a regex)
+    :returns: a sorted list of indices
+    """
+    return sorted(chain.from_iterable(
+        indices for stress, indices in _search_index(_index_stresses).items()
+        if test(stress)))
+
+
+def _index_phones(lines):
+    """Index strings of phones by the phones in them.
+
+    :param lines: a list of strings of phones
+    :returns: a dictionary mapping each phone to an array of the indices of
+        the strings containing it
+    """
+    index = collections.defaultdict(lambda: array('l'))
+    for i, line in enumerate(lines):
+        for phone in set(line.split()):
+            index[phone].append(i)
+    return dict(index)
+
+
+def _search_postings(phones):
+    """Get the indices of pronunciations containing a sequence of phones.
+
+    This uses an index of which pronunciations each phone appears in. A
+    single phone is just looked up; for a longer sequence, the
+    pronunciations containing its rarest phone are checked one by one.
+
+    Building the index takes a while, so it's only built once there have
+    been enough of these searches for it to pay off. Until then, this
+    returns None, and the dictionary is scanned instead.
+
+    :param phones: a string of space-separated phones
+    :returns: a sorted list of indices, or None if the index isn't built
+        yet, or if the rarest phone is too common for this to beat scanning
+        the whole dictionary
+    """
+    global _postings_searches
+    if _index_phones not in _search_indexes:
+        _postings_searches += 1
+        if _postings_searches < _postings_min:
+            return None
+    postings = _search_index(_index_phones)
+    lines = _phones
+    phones_list = phones.split(' ')
+    candidates = min((postings.get(phone, ()) for phone in phones_list),
+                     key=len)
+    if len(phones_list) == 1:
+        return candidates
+    if len(candidates) * 50 > len(lines):
+        return None
+    regexp = _compile(r"\b" + phones + r"\b")
+    return [i for i in candidates if regexp.search(lines[i])]
+
+
+def _compile(pattern, flags=0):
+    """Compile a regular expression, reusing it if it's been compiled before.
+
+    Compiled patterns are kept around, so calling :func:`search` in a loop
+    with the same handful of patterns doesn't compile them over and over.
+    (Like the ``re`` module's own cache, this one is simply emptied when it
+    fills up.)
+
+    :param pattern: a string containing a regular expression
+    :param flags: flags to compile the pattern with (e.g. ``re.MULTILINE``
+        for searching the joined blob of lines in :func:`_scan`)
+    :returns: the compiled pattern
+    """
+    try:
+        return _regex_cache[pattern, flags]
+    except KeyError:
+        if len(_regex_cache) >= _regex_cache_size:
+            _regex_cache.clear()
+        regexp = _regex_cache[pattern, flags] = re.compile(pattern, flags)
+        return regexp
+
+
+def _scan(regexp, prefilter, lines, blob, starts):
+    """Yield the index of each line matched by a regex, using a joined blob.
+
+    Searching one big string moves the loop over the dictionary into the
+    regular expression engine. The blob is only used to find candidates,
+    though: each one is checked against its line alone, since a match in
+    the blob may run across a line break (e.g. because the pattern contains
+    ``\\s`` or a negated character class).
+
+    Patterns that can see past the ends of a line (with ``\\A``, ``\\Z``, a
+    lookaround or a scoped flag like ``(?-m:...)``) may miss lines in the
+    blob, so don't use this for those.
+
+    :param regexp: a compiled regular expression, for checking each line
+    :param prefilter: a version of ``regexp`` compiled with ``re.MULTILINE``
+        (so that ``^`` and ``$`` match at each line), for finding candidates
+        in the blob; it can be looser than ``regexp`` (e.g. without its
+        leading ``\\b``, which keeps the regex engine from skipping ahead to
+        the pattern's literal prefix)
+    :param lines: a list of strings
+    :param blob: the lines joined with :func:`_join_lines`
+    :param starts: the array of line offsets returned from :func:`_join_lines`
+    """
+    count = len(lines)
+    pos = 0
+    while pos < starts[-1]:
+        match = prefilter.search(blob, pos)
+        if match is None:
+            return
+        i = bisect_right(starts, match.start()) - 1
+        # matching lines tend to come in runs (e.g. variant pronunciations of
+        # the same word), so keep checking line by line until one fails
+        while i < count and regexp.search(lines[i]):
+            yield i
+            i += 1
+        pos = starts[i + 1] if i < count else starts[-1]
+
+
+def _limited(found, limit):
+    """Cut search results off after a given number of them.
+
+    :param found: an iterable of indices
+    :param limit: the number of indices to keep, where ``None`` or ``0``
+        means to keep them all
+    :returns: an iterable of at most ``limit`` indices
+    """
+    if limit is None:
+        return found
+    if not isinstance(limit, numbers.Integral):
+        raise TypeError("limit must be an integer")
+    if limit < 0:
+        raise ValueError("limit can't be negative")
+    if limit == 0:
+        return found
+    return islice(found, limit)
 
 
 def syllable_count(phones):
@@ -94,7 +476,8 @@ def phones_for_word(find):
     :param find: a word to find in CMUdict.
     :returns: a list of phone strings that correspond to that word.
     """
-    init_cmu()
+    if lookup is None:
+        init_cmu()
     return lookup.get(find.lower(), [])
 
 
@@ -112,7 +495,11 @@ def stresses(s):
     :param s: a string of CMUdict phones
     :returns: string of just the stresses
     """
-    return re.sub(r"[^012]", "", s)
+    try:
+        return s.translate(_stress_table)
+    except TypeError:
+        # byte strings on Python 2 don't take a mapping
+        return re.sub(r"[^012]", "", s)
 
 
 def stresses_for_word(find):
@@ -127,8 +514,10 @@ def stresses_for_word(find):
     :param find: a word to find
     :returns: a list of possible stress patterns for the given word.
     """
-    phone_lists = phones_for_word(find)
-    return list(map(stresses, phone_lists))
+    # phones from the dictionary are always text, so they can be translated
+    # directly without going through stresses()
+    return [phones.translate(_stress_table)
+            for phones in phones_for_word(find)]
 
 
 def rhyming_part(phones):
@@ -147,14 +536,15 @@ def rhyming_part(phones):
     :param phones: a string containing space-separated CMUdict phones
     :returns: a string with just the "rhyming part" of those phones
     """
-    phones_list = phones.split()
-    for i in range(len(phones_list) - 1, 0, -1):
-        if phones_list[i][-1] in '12':
-            return ' '.join(phones_list[i:])
-    return phones
+    # stress digits only come at the end of a phone, so the last 1 or 2 in the
+    # string belongs to the last stressed vowel
+    i = max(phones.rfind('1'), phones.rfind('2'))
+    if i < 0:
+        return phones
+    return phones[phones.rfind(' ', 0, i) + 1:]
 
 
-def search(pattern):
+def search(pattern, limit=None):
     """Get words whose pronunciation matches a regular expression.
 
     This function Searches the CMU dictionary for pronunciations matching a
@@ -166,18 +556,98 @@ def search(pattern):
         >>> import pronouncing
         >>> 'interpolate' in pronouncing.search('ER1 P AH0')
         True
+        >>> pronouncing.search('IH1 D AH0 L$', limit=3)
+        ['biddle', 'criddle', 'diddle']
 
     :param pattern: a string containing a regular expression
+    :param limit: if given, stop searching after this many matches (``None``
+        or ``0`` means no limit)
     :returns: a list of matching words
     """
-    init_cmu()
-    regexp = re.compile(r"\b" + pattern + r"\b")
-    return [word
-            for word, phones in pronunciations
-            if regexp.search(phones)]
+    _init_search()
+    found = None
+    literal = _anchored_literal.match(pattern)
+    if literal is not None:
+        start, phones, end = literal.groups()
+        if start:
+            found = _search_sorted(_search_index(_sort_lines), phones,
+                                   whole=bool(end))
+        elif end:
+            found = _search_sorted(_search_index(_sort_reversed_lines),
+                                   phones[::-1])
+        else:
+            found = _search_postings(phones)
+    if found is None:
+        regexp = _compile(r"\b" + pattern + r"\b")
+        prefix = _literal_prefix(pattern)
+        if prefix:
+            found = _search_prefixed(regexp, prefix)
+        elif _context_sensitive.search(pattern):
+            found = compress(range(len(_phones)), map(regexp.search, _phones))
+        else:
+            prefilter = _compile(pattern + r"\b", re.MULTILINE)
+            found = _scan(regexp, prefilter, _phones, _phones_blob,
+                          _phones_starts)
+    return list(map(_words.__getitem__, _limited(found, limit)))
+
+
+def search_many(patterns):
+    """Get words whose pronunciation matches each of several patterns.
+
+    This gives the same results as calling :func:`search` once for each
+    pattern. When there are a lot of patterns that are plain sequences of
+    phones (like ``'ER1 P AH0'``), all of those are looked for in a single
+    pass over the dictionary, rather than one pass per pattern.
 
+    .. doctest::
 
-def search_stresses(pattern):
+        >>> import pronouncing
+        >>> matches = pronouncing.search_many(['ER1 P AH0', '^S K L'])
+        >>> matches['^S K L']
+        ['sclafani', 'scleroderma', 'sclerosis', 'sklar', 'sklenar']
+
+    :param patterns: a list of strings containing regular expressions
+    :returns: a dictionary mapping each pattern to a list of matching words
+    """
+    _init_search()
+    sequences = [pattern for pattern in patterns
+                 if _anchored_literal.match(pattern)
+                 and not pattern.startswith('^')
+                 and not pattern.endswith('$')]
+    if len(sequences) < _search_many_min:
+        sequences = []
+    matches = dict((pattern, []) for pattern in sequences)
+    # a trie of phone sequences, where the key None marks the end of one
+    trie = {}
+    for pattern in sequences:
+        node = trie
+        for phone in pattern.split(' '):
+            node = node.setdefault(phone, {})
+        node[None] = pattern
+    if trie:
+        for word, phones in pronunciations:
+            phones_list = phones.split()
+            count = len(phones_list)
+            found = set()
+            for i, phone in enumerate(phones_list):
+                node = trie.get(phone)
+                j = i + 1
+                while node is not None:
+                    if None in node:
+                        found.add(node[None])
+                    if j == count:
+                        break
+                    node = node.get(phones_list[j])
+                    j += 1
+            for pattern in found:
+                matches[pattern].append(word)
+    for pattern in patterns:
+        if pattern not in matches:
+            matches[pattern] = search(pattern)
+    return matches
+
+
+def search_stresses(pattern, limit=None):
     """Get words whose stress pattern matches a regular expression.
 
     This function is a special case of :func:`search` that searches only the
@@ -191,13 +661,17 @@ def search_stresses(pattern):
         ['gubernatorial']
 
     :param pattern: a string containing a regular expression
+    :param limit: if given, stop searching after this many matches (``None``
+        or ``0`` means no limit)
     :returns: a list of matching words
     """
-    init_cmu()
-    regexp = re.compile(pattern)
-    return [word
-            for word, phones in pronunciations
-            if regexp.search(stresses(phones))]
+    _init_search()
+    literal = _stress_literal.match(pattern)
+    if literal is not None:
+        found = _search_index(_index_stresses).get(literal.group(1), [])
+    else:
+        found = _search_stress_lookup(_compile(pattern).search)
+    return list(map(_words.__getitem__, _limited(found, limit)))
 
 
 def rhymes(word):
@@ -216,14 +690,24 @@ def rhymes(word):
     :param word: a word
     :returns: a list of rhyming words
     """
-    phones = phones_for_word(word)
-    combined_rhymes = []
-    if phones:
-        for element in phones:
-            combined_rhymes.append([w for w in rhyme_lookup.get(rhyming_part(
-                                    element), []) if w != word])
-        combined_rhymes = list(chain.from_iterable(combined_rhymes))
-        unique_combined_rhymes = sorted(set(combined_rhymes))
-        return unique_combined_rhymes
-    else:
-        return []
+    global _rhymes_indexed
+    word = word.lower()
+    if _rhymes_indexed is not rhyme_lookup:
+        # the pronunciation data has been (re)loaded since these were cached
+        _rhymes_cache.clear()
+    try:
+        return list(_rhymes_cache[word])
+    except KeyError:
+        pass
+    found = sorted(set(
+        rhyme
+        for phones in phones_for_word(word)
+        for rhyme in rhyme_lookup.get(rhyming_part(phones), [])
+        if rhyme != word))
+    # a word's rhymes can number in the thousands, so keep the sorted result
+    # around for the next call (see _compile() for the same idea)
+    if len(_rhymes_cache) >= _rhymes_cache_size:
+        _rhymes_cache.clear()
+    _rhymes_indexed = rhyme_lookup
+    _rhymes_cache[word] = tuple(found)
+    return found
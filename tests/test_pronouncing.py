@@ -1,6 +1,8 @@
 import unittest
 import pronouncing
 import io
+import re
+import threading
 
 
 class TestPronouncing(unittest.TestCase):
@@ -16,6 +18,20 @@ ADOLESCENT(1)  AE2 D OW0 L EH1 S AH0 N T
         matches = [x for x in pronunciations if x[0] == 'adolescent']
         self.assertEqual(len(matches), 2)
 
+    def test_parse_cmu_indented_comment(self):
+        test_str = b"  ;;; comment here\nFOO F UW1\n"
+        pronunciations = pronouncing.parse_cmu(io.BytesIO(test_str))
+        self.assertEqual(pronunciations, [('foo', 'F UW1')])
+
+    def test_parse_cmu_comments(self):
+        test_str = b"""\
+aalborg AO1 L B AO0 R G # place, danish
+aalborg(2) AA1 L B AO0 R G
+"""
+        pronunciations = pronouncing.parse_cmu(io.BytesIO(test_str))
+        self.assertEqual(pronunciations, [('aalborg', 'AO1 L B AO0 R G'),
+                                          ('aalborg', 'AA1 L B AO0 R G')])
+
     def test_syllable_count(self):
         self.assertEqual(pronouncing.syllable_count("CH IY1 Z"), 1)
         self.assertEqual(pronouncing.syllable_count("CH EH1 D ER0"), 2)
@@ -58,6 +74,113 @@ ADOLESCENT(1)  AE2 D OW0 L EH1 S AH0 N T
                              'diminishing', 'elicited', 'miscibility',
                              'primitivistic', 'privileges'])
 
+    def test_search_anchored(self):
+        matches = pronouncing.search('IH1 D AH0 L$')
+        self.assertEqual(matches[:5],
+                         ['biddle', 'criddle', 'diddle', 'fiddle', 'friddle'])
+        matches = pronouncing.search('^EY1$')
+        self.assertEqual(matches, ['a', 'a.', 'ae', 'ay'])
+        # anchored patterns still only match whole phones
+        self.assertEqual(pronouncing.search('^S K$'), [])
+        self.assertEqual(pronouncing.search('^S K'),
+                         pronouncing.search('^S K\\b'))
+
+    def test_search_anchored_regex(self):
+        # anchored patterns only check phones starting with their fixed part
+        matches = pronouncing.search('^S K L?')
+        self.assertIn('sclerosis', matches)
+        self.assertIn('scott', matches)
+        self.assertEqual(pronouncing.search('^S K L+'),
+                         ['sclafani', 'scleroderma', 'sclerosis', 'sklar',
+                             'sklenar'])
+        self.assertEqual(pronouncing.search('^S K|^S K L'),
+                         pronouncing.search('^S K'))
+
+    def test_search_context_sensitive(self):
+        # \A, \Z, lookarounds and scoped flags only see the pronunciation
+        # being searched
+        pronouncing.init_cmu()
+        for pattern in ['\\AS K', 'T\\Z', 'T(?=\\s)', '(?<=\\s)K',
+                        '(?<=\\n)K', '(?<!\\n)K', 'T(?!\\s)', 'T(?-m:$)',
+                        '(?-m:^)S K L', '(?s:K.)T']:
+            regexp = re.compile('\\b' + pattern + '\\b')
+            expected = [word for word, phones in pronouncing.pronunciations
+                        if regexp.search(phones)]
+            self.assertEqual(pronouncing.search(pattern), expected)
+        self.assertEqual(pronouncing.search('(?<=\\n)K'), [])
+
+    def test_init_cmu_search_indexes(self):
+        pronouncing.init_cmu()
+        pronouncing._indexed = None
+        pronouncing.init_cmu(search_indexes=True)
+        self.assertIs(pronouncing._indexed, pronouncing.pronunciations)
+        self.assertIn(pronouncing._sort_lines, pronouncing._search_indexes)
+
+    def test_search_threads(self):
+        # searches that start while the indexes are being built wait for them
+        pronouncing.init_cmu()
+        pronouncing._indexed = None
+        results = []
+
+        def search():
+            try:
+                results.append(pronouncing.search('^S K L'))
+            except Exception as e:
+                results.append(e)
+        threads = [threading.Thread(target=search) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [['sclafani', 'scleroderma', 'sclerosis',
+                                    'sklar', 'sklenar']] * 8)
+
+    def test_search_phone_sequence(self):
+        # plain phone sequences are looked up in an index once there have
+        # been enough of them; adding a redundant \b forces the regex path
+        # for comparison
+        patterns = ['ZH', 'AH0', 'ZH AH0', 'ER1 P AH0', 'AH0 N']
+        expected = [pronouncing.search(pattern + '\\b')
+                    for pattern in patterns]
+        for i in range(pronouncing._postings_min):
+            pronouncing.search('ZH')
+        self.assertIn(pronouncing._index_phones, pronouncing._search_indexes)
+        self.assertEqual([pronouncing.search(pattern)
+                          for pattern in patterns], expected)
+        self.assertEqual(pronouncing.search('AH'), [])
+
+    def test_search_limit(self):
+        for pattern in ['^S K L', 'AH0', 'IH. \\w* IH. \\w* IH. \\w* IH.']:
+            matches = pronouncing.search(pattern)
+            self.assertEqual(pronouncing.search(pattern, limit=3),
+                             matches[:3])
+        words = pronouncing.search_stresses('^[12]0[12]0[12]0[12]$', limit=2)
+        self.assertEqual(words, ['dideoxycytidine', 'homosexuality'])
+
+    def test_search_limit_values(self):
+        matches = pronouncing.search('^S K L')
+        self.assertEqual(pronouncing.search('^S K L', limit=0), matches)
+        self.assertEqual(pronouncing.search_stresses('020120', limit=0),
+                         ['gubernatorial'])
+        self.assertRaises(ValueError, pronouncing.search, '^S K L', limit=-1)
+        self.assertRaises(ValueError, pronouncing.search_stresses, '020120',
+                          limit=-1)
+
+    def test_search_many(self):
+        patterns = ['ER1 P AH0', '^S K L', 'IH. \\w* IH. \\w* IH. \\w* IH.']
+        matches = pronouncing.search_many(patterns)
+        for pattern in patterns:
+            self.assertEqual(matches[pattern], pronouncing.search(pattern))
+
+    def test_search_many_batched(self):
+        # enough phone sequences to take the single-pass path
+        pronouncing.init_cmu()
+        patterns = [' '.join(phones.split()[-2:])
+                    for word, phones in pronouncing.pronunciations[::1000]]
+        matches = pronouncing.search_many(patterns)
+        for pattern in patterns[::10]:
+            self.assertEqual(matches[pattern], pronouncing.search(pattern))
+
     def test_rhymes_for_single_pronunciation(self):
         rhymes = pronouncing.rhymes("sleekly")
         expected = [
@@ -78,6 +201,27 @@ ADOLESCENT(1)  AE2 D OW0 L EH1 S AH0 N T
             "wove"]
         self.assertEqual(expected, rhymes)
        
+    def test_rhymes_uppercase(self):
+        rhymes = pronouncing.rhymes("SLEEKLY")
+        self.assertEqual(pronouncing.rhymes("sleekly"), rhymes)
+        self.assertNotIn("sleekly", rhymes)
+
+    def test_rhymes_does_not_modify_lookup(self):
+        # the word itself is filtered out of a copy, not the shared index
+        first = pronouncing.rhymes("sleekly")
+        rhyming_part = pronouncing.rhyming_part(
+            pronouncing.phones_for_word("sleekly")[0])
+        self.assertIn("sleekly", pronouncing.rhyme_lookup[rhyming_part])
+        self.assertEqual(first, pronouncing.rhymes("sleekly"))
+
+    def test_rhymes_cached(self):
+        # repeated calls give equal lists, but not the same (mutable) list
+        first = pronouncing.rhymes("dove")
+        first.append("xyzzy")
+        second = pronouncing.rhymes("dove")
+        self.assertNotIn("xyzzy", second)
+        self.assertIsNot(first, second)
+
     def test_rhymes_for_non_rhyming(self):
         # ensure correct behavior for words that don't rhyme
         rhymes = pronouncing.rhymes("orange")
@@ -113,6 +257,12 @@ ADOLESCENT(1)  AE2 D OW0 L EH1 S AH0 N T
             words,
             ['dideoxycytidine', 'homosexuality', 'hypersensitivity'])
 
+    def test_no_comments_in_phones(self):
+        phones = pronouncing.phones_for_word("aalborg")
+        self.assertEqual(phones, ['AO1 L B AO0 R G', 'AA1 L B AO0 R G'])
+        for pronunciation in pronouncing.pronunciations:
+            self.assertNotIn('#', pronunciation[1])
+
     def test_a(self):
         words = pronouncing.phones_for_word('a')
         self.assertEqual(words, ['AH0', 'EY1'])